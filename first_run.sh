@@ -13,6 +13,10 @@ if ! command -v python3 &> /dev/null; then
     echo "❌ Python 3 is required. Please install it first."
     exit 1
 fi
+if ! python3 -c 'import sqlite3, sys; sys.exit(sys.version_info < (3, 10) or sqlite3.sqlite_version_info < (3, 35))'; then
+    echo "❌ Python 3.10+ with SQLite 3.35+ is required."
+    exit 1
+fi
 
 # Install Python dependencies (if any)
 if [ -f requirements.txt ]; then
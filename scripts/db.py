@@ -0,0 +1,38 @@
+"""
+Shared SQLite connection helpers for the database scripts.
+Opens connections tuned for bulk imports (WAL, relaxed sync, larger cache).
+"""
+
+import sqlite3
+from pathlib import Path
+
+DB_PATH = Path(__file__).parent.parent / "music_crossword.db"
+
+# The importers resolve ids with INSERT ... RETURNING, added in SQLite 3.35
+if sqlite3.sqlite_version_info < (3, 35):
+    raise RuntimeError(f"SQLite 3.35+ is required (Python is linked against {sqlite3.sqlite_version})")
+
+# Applied to every connection opened through this module
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+def connect(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    """
+    Open a new tuned connection.
+
+    The connection is in autocommit mode (isolation_level=None), so callers
+    control transactions explicitly with BEGIN / COMMIT / ROLLBACK.
+    """
+    conn = sqlite3.connect(
+        db_path,
+        cached_statements=512,
+        isolation_level=None
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
@@ -9,7 +9,8 @@ import sys
 import shutil
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "music_crossword.db"
+from db import DB_PATH
+
 SCHEMA_PATH = Path(__file__).parent.parent / "schema.sql"
 
 def init_database():
@@ -39,6 +40,9 @@ def init_database():
         conn.executescript(schema_sql)
         conn.commit()
         
+        # WAL is persistent: every later connection to this file uses it
+        conn.execute("PRAGMA journal_mode=WAL")
+        
         # Verify tables were created
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;")
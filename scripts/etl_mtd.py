@@ -5,25 +5,50 @@ Parses CSV files and JSON metadata, normalizes melodies, and populates the datab
 """
 
 import sqlite3
-import hashlib
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Tuple
 from dataclasses import dataclass
-from mtd_parser import MTDParser, MTDTheme
+from mtd_parser import MTDParser, MTDTheme, ThemeSummary
+from db import DB_PATH, connect
+from theme_utils import checksum
 
-DB_PATH = Path(__file__).parent.parent / "music_crossword.db"
 MTD_ROOT = Path(__file__).parent.parent / "nonessential/data/MTD"
 
 # Most recognizable composers (for filtering)
-RECOGNIZABLE_COMPOSERS = {
+RECOGNIZABLE_COMPOSERS = frozenset({
     'Beethoven', 'Mozart', 'Bach', 'Chopin', 'Tchaikovsky', 'Vivaldi',
     'Handel', 'Schubert', 'Brahms', 'Debussy', 'Haydn', 'Schumann',
     'Mendelssohn', 'Liszt', 'Wagner', 'Strauss', 'Dvorak', 'Prokofiev',
     'Rachmaninoff', 'Stravinsky', 'Bizet', 'Puccini', 'Verdi', 'Rossini'
-}
+})
 
-@dataclass
+# Worker threads used to read and parse theme files
+PARSE_WORKERS = 8
+
+# Motifs are written in batches of this many rows per executemany call
+BATCH_SIZE = 1000
+
+# Duplicate checksums are skipped by the engine so a single collision
+# cannot abort a batch; other constraint violations still raise
+INSERT_MOTIF_SQL = """
+    INSERT INTO motifs (
+        pitch_sequence, rhythm_sequence, interval_profile, length,
+        allowed_transpositions, first_pitch, last_pitch,
+        source_id, original_filename, descriptor,
+        license, difficulty, recognition_score, checksum
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(checksum) DO NOTHING
+"""
+INSERT_COMPOSER_TAG_SQL = "INSERT INTO tags (name, category) VALUES (?, 'composer') RETURNING id"
+INSERT_MOTIF_TAG_SQL = """
+    INSERT INTO motif_tags (motif_id, tag_id) VALUES (?, ?)
+    ON CONFLICT(motif_id, tag_id) DO NOTHING
+"""
+
+@dataclass(slots=True)
 class ProcessingStats:
     """Statistics for ETL run."""
     total_files: int = 0
@@ -34,6 +59,7 @@ class ProcessingStats:
     too_short: int = 0  # < 4 notes
     too_long: int = 0   # > 15 notes (for crossword)
     filtered_out: int = 0  # Not in recognizable composers list
+    prefiltered: int = 0   # Composer in filename not recognizable (not parsed)
 
 
 class MTDETL:
@@ -44,6 +70,8 @@ class MTDETL:
         self.mtd_root = mtd_root
         self.parser = MTDParser(mtd_root)
         self.stats = ProcessingStats()
+        self._tag_cache = {}  # tag name -> id, loaded once per run
+        self._seen_checksums = set()  # motif checksums already in the database
         
         if not self.db_path.exists():
             print(f"❌ Database not found: {self.db_path}")
@@ -68,8 +96,13 @@ class MTDETL:
         print(f"   Motif length: {min_notes}-{max_notes} notes")
         print(f"   Only recognizable composers: {only_recognizable}")
         
-        # Find all metadata files
-        meta_files = sorted(self.mtd_root.glob("data_META/*.json"))
+        # Find all metadata files (scandir lists names without per-entry Path work)
+        meta_dir = self.mtd_root / "data_META"
+        meta_names = []
+        if meta_dir.is_dir():
+            with os.scandir(meta_dir) as entries:
+                meta_names = [entry.name for entry in entries if entry.name.endswith(".json")]
+        meta_files = [meta_dir / name for name in sorted(meta_names)]
         
         if limit:
             meta_files = meta_files[:limit]
@@ -79,132 +112,208 @@ class MTDETL:
         
         self.stats.total_files = len(meta_files)
         
-        # Connect to database
-        conn = sqlite3.connect(self.db_path)
+        # Skip files whose name already shows a composer outside the list,
+        # without reading them; the parsed ComposerID is still checked later
+        if only_recognizable:
+            known_composers = RECOGNIZABLE_COMPOSERS
+            composer_from_filename = self._composer_from_filename
+            candidates = [
+                meta_file for meta_file in meta_files
+                if (composer := composer_from_filename(meta_file)) is None
+                or composer in known_composers
+            ]
+            self.stats.prefiltered = len(meta_files) - len(candidates)
+            meta_files = candidates
+            print(f"   Prefiltered: {self.stats.prefiltered} themes (composer from filename)")
+            print(f"   Parsing: {len(meta_files)} themes")
+        
+        # Connect to database (tuned PRAGMAs, autocommit mode) and run the
+        # whole import as one explicit write transaction
+        conn = connect(self.db_path)
         cursor = conn.cursor()
         
         try:
+            cursor.execute("BEGIN IMMEDIATE")
+            
             # Get or create MTD source
             source_id = self._get_or_create_source(cursor)
             
-            # Process each theme
-            for i, meta_file in enumerate(meta_files, 1):
-                if i % 50 == 0:
-                    print(f"   Progress: {i}/{len(meta_files)} themes...")
-                
-                self._process_theme(meta_file, cursor, source_id, min_notes, max_notes, only_recognizable)
+            # Load existing tag ids once instead of looking them up per theme
+            cursor.execute("SELECT name, id FROM tags")
+            self._tag_cache = dict(cursor.fetchall())
+            
+            # Load existing checksums so duplicates are rejected before insert
+            cursor.execute("SELECT checksum FROM motifs WHERE checksum IS NOT NULL")
+            self._seen_checksums = {row[0] for row in cursor}
+            
+            # Process each theme, collecting motif rows for batched inserts.
+            # Files are read and parsed on worker threads (map() keeps input
+            # order); all database work stays on this thread.
+            motif_rows = []
+            composers = []
+            with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+                parsed_themes = executor.map(self._parse_theme_safe, meta_files)
+                for i, (meta_file, parsed) in enumerate(zip(meta_files, parsed_themes), 1):
+                    if i % 50 == 0:
+                        print(f"   Progress: {i}/{len(meta_files)} themes...")
+                    
+                    theme_row = self._process_theme(meta_file, parsed, source_id,
+                                                    min_notes, max_notes, only_recognizable)
+                    if theme_row:
+                        motif_rows.append(theme_row[0])
+                        composers.append(theme_row[1])
+                    
+                    if len(motif_rows) >= BATCH_SIZE:
+                        self._insert_batch(cursor, motif_rows, composers)
+                        motif_rows.clear()
+                        composers.clear()
+            
+            if motif_rows:
+                self._insert_batch(cursor, motif_rows, composers)
             
             # Commit all changes
-            conn.commit()
+            cursor.execute("COMMIT")
             
             # Print statistics
             self._print_stats()
             
         except Exception as e:
             print(f"❌ ETL failed: {e}")
-            conn.rollback()
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
             raise
         finally:
             conn.close()
     
-    def _process_theme(self, meta_file: Path, cursor: sqlite3.Cursor,
-                      source_id: int, min_notes: int, max_notes: int,
-                      only_recognizable: bool):
-        """Process a single theme."""
+    def _composer_from_filename(self, meta_file: Path) -> Optional[str]:
+        """
+        Get the composer encoded in an MTD metadata filename
+        (e.g. "MTD1005_Beethoven_Op096-01.json" -> "Beethoven"), or None if
+        the name does not follow that convention.
+        """
+        parts = meta_file.stem.split('_')
+        if len(parts) < 3 or not parts[0].startswith("MTD"):
+            return None
+        return parts[1]
+    
+    def _parse_theme_safe(self, meta_file: Path):
+        """Parse a theme on a worker thread, returning the exception instead of raising it."""
         try:
-            # Parse theme
-            theme = self.parser.parse_theme_from_file(meta_file)
+            return self.parser.parse_theme_from_file(meta_file)
+        except Exception as e:
+            return e
+    
+    def _process_theme(self, meta_file: Path, parsed, source_id: int,
+                      min_notes: int, max_notes: int,
+                      only_recognizable: bool) -> Optional[Tuple[tuple, str]]:
+        """
+        Process a single parsed theme (MTDTheme, None, or the parse exception).
+        Returns (motif_row, composer) if the theme should be inserted, else None.
+        """
+        stats = self.stats
+        if isinstance(parsed, Exception):
+            print(f"⚠️  Error processing {meta_file.name}: {parsed}")
+            stats.errors += 1
+            return None
+        
+        try:
+            theme = parsed
             
             if not theme:
-                self.stats.errors += 1
+                stats.errors += 1
                 return
             
-            self.stats.parsed += 1
+            stats.parsed += 1
             
             # Filter by composer if requested
             if only_recognizable and theme.composer not in RECOGNIZABLE_COMPOSERS:
-                self.stats.filtered_out += 1
+                stats.filtered_out += 1
                 return
             
             # Check length
             if len(theme.notes) < min_notes:
-                self.stats.too_short += 1
+                stats.too_short += 1
                 return
             
             if len(theme.notes) > max_notes:
-                self.stats.too_long += 1
+                stats.too_long += 1
+                return
+            
+            # Derive sequences and interval data in one pass over the notes
+            summary = theme.summarize()
+            
+            # Compute checksum for duplicate detection
+            motif_checksum = checksum(summary.pitch_sequence)
+            
+            # Reject duplicates before building the row
+            if motif_checksum in self._seen_checksums:
+                stats.duplicates += 1
                 return
+            self._seen_checksums.add(motif_checksum)
             
-            # Insert theme
-            if self._insert_theme(cursor, theme, source_id):
-                self.stats.inserted += 1
-            else:
-                self.stats.duplicates += 1
+            return self._build_motif_row(theme, summary, source_id, motif_checksum), theme.composer
         
         except Exception as e:
             print(f"⚠️  Error processing {meta_file.name}: {e}")
-            self.stats.errors += 1
+            stats.errors += 1
+        return None
     
-    def _insert_theme(self, cursor: sqlite3.Cursor, theme: MTDTheme, source_id: int) -> bool:
-        """Insert theme into database. Returns True if inserted, False if duplicate."""
-        # Extract data for database
-        pitch_sequence = theme.to_pitch_sequence()
-        rhythm_sequence = theme.to_rhythm_sequence()
-        interval_profile = theme.compute_interval_profile()
-        
-        # Compute checksum for duplicate detection
-        checksum = hashlib.sha256(pitch_sequence.encode()).hexdigest()
-        
+    def _build_motif_row(self, theme: MTDTheme, summary: ThemeSummary,
+                         source_id: int, checksum: str) -> tuple:
+        """Build the motifs row for a theme (column order of INSERT_MOTIF_SQL)."""
         # Determine first and last pitch
         first_pitch = theme.notes[0].pitch_class if theme.notes else None
         last_pitch = theme.notes[-1].pitch_class if theme.notes else None
         
         # Compute difficulty (simple heuristic based on length and interval complexity)
-        difficulty = self._compute_difficulty(theme)
+        difficulty = self._compute_difficulty(len(theme.notes), summary.avg_interval)
         
         # Recognition score: higher for recognizable composers
         recognition_score = 8 if theme.composer in RECOGNIZABLE_COMPOSERS else 6
         
-        # Create descriptor
+        # Create descriptor (the parser already falls back to work_id for missing titles)
         descriptor = f"{theme.composer} - {theme.work_title}"
-        if not theme.work_title or theme.work_title == theme.work_id:
-            descriptor = f"{theme.composer} - {theme.work_id}"
         
-        # Insert motif
-        try:
-            cursor.execute("""
-                INSERT INTO motifs (
-                    pitch_sequence, rhythm_sequence, interval_profile, length,
-                    allowed_transpositions, first_pitch, last_pitch,
-                    source_id, original_filename, descriptor,
-                    license, difficulty, recognition_score, checksum
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                pitch_sequence,
-                rhythm_sequence,
-                interval_profile,
-                len(theme.notes),
-                '*',  # Allow all transpositions
-                first_pitch,
-                last_pitch,
-                source_id,
-                f"MTD{theme.mtd_id}.csv",
-                descriptor,
-                'Public Domain',  # Most classical works are PD
-                difficulty,
-                recognition_score,
-                checksum
-            ))
-            
-            # Add composer tag
-            motif_id = cursor.lastrowid
-            self._add_composer_tag(cursor, motif_id, theme.composer)
-            
-            return True
-            
-        except sqlite3.IntegrityError:
-            # Duplicate checksum
-            return False
+        return (
+            summary.pitch_sequence,
+            summary.rhythm_sequence,
+            summary.interval_profile,
+            len(theme.notes),
+            '*',  # Allow all transpositions
+            first_pitch,
+            last_pitch,
+            source_id,
+            f"MTD{theme.mtd_id}.csv",
+            descriptor,
+            'Public Domain',  # Most classical works are PD
+            difficulty,
+            recognition_score,
+            checksum
+        )
+    
+    def _insert_batch(self, cursor: sqlite3.Cursor, motif_rows: List[tuple], composers: List[str]):
+        """Insert a batch of motif rows and tag the new motifs with their composer."""
+        # AUTOINCREMENT ids only grow, so rows above the current max are this batch's
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM motifs")
+        prev_max_id = cursor.fetchone()[0]
+        
+        cursor.executemany(INSERT_MOTIF_SQL, motif_rows)
+        inserted = cursor.rowcount
+        self.stats.inserted += inserted
+        self.stats.duplicates += len(motif_rows) - inserted
+        
+        # lastrowid is not set by executemany; map checksums back to the new ids
+        cursor.execute("SELECT checksum, id FROM motifs WHERE id > ?", (prev_max_id,))
+        new_ids = dict(cursor.fetchall())
+        
+        new_motifs = []
+        for row, composer in zip(motif_rows, composers):
+            # pop() so a checksum repeated within the batch is only tagged once
+            motif_id = new_ids.pop(row[-1], None)
+            if motif_id is not None:
+                new_motifs.append((motif_id, composer))
+        
+        self._add_composer_tags(cursor, new_motifs)
     
     def _get_or_create_source(self, cursor: sqlite3.Cursor) -> int:
         """Get or create MTD source."""
@@ -217,6 +326,7 @@ class MTDETL:
         cursor.execute("""
             INSERT INTO sources (name, region, collection, license, url, notes)
             VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING id
         """, (
             "MTD - Musical Theme Dataset",
             "Various",
@@ -226,47 +336,31 @@ class MTDETL:
             "2,067 classical and modern musical themes"
         ))
         
-        return cursor.lastrowid
+        return cursor.fetchone()[0]
     
-    def _add_composer_tag(self, cursor: sqlite3.Cursor, motif_id: int, composer: str):
-        """Add composer tag."""
-        # Get or create tag
-        cursor.execute("SELECT id FROM tags WHERE name = ?", (composer,))
-        row = cursor.fetchone()
-        
-        if row:
-            tag_id = row[0]
-        else:
-            cursor.execute("""
-                INSERT INTO tags (name, category)
-                VALUES (?, 'composer')
-            """, (composer,))
-            tag_id = cursor.lastrowid
-        
-        # Link motif to tag
-        try:
-            cursor.execute("""
-                INSERT INTO motif_tags (motif_id, tag_id)
-                VALUES (?, ?)
-            """, (motif_id, tag_id))
-        except sqlite3.IntegrityError:
-            pass  # Already tagged
+    def _add_composer_tags(self, cursor: sqlite3.Cursor, new_motifs: List[Tuple[int, str]]):
+        """Add composer tags for (motif_id, composer) pairs."""
+        tag_cache = self._tag_cache
+        
+        # Create tags for composers not seen before; RETURNING gives the new id
+        for _, composer in new_motifs:
+            if composer not in tag_cache:
+                cursor.execute(INSERT_COMPOSER_TAG_SQL, (composer,))
+                tag_cache[composer] = cursor.fetchone()[0]
+        
+        # Link motifs to tags
+        cursor.executemany(INSERT_MOTIF_TAG_SQL, [
+            (motif_id, tag_cache[composer]) for motif_id, composer in new_motifs
+        ])
     
-    def _compute_difficulty(self, theme: MTDTheme) -> int:
+    def _compute_difficulty(self, length: int, avg_interval: float) -> int:
         """
-        Compute difficulty score (1-5) based on length and interval complexity.
-        Simple heuristic for MVP.
+        Compute difficulty score (1-5) based on length and average absolute
+        interval size (from MTDTheme.summarize). Simple heuristic for MVP.
         """
-        length = len(theme.notes)
-        indices = theme.to_pitch_indices()
-        
-        # Compute average absolute interval size
-        if len(indices) < 2:
+        if length < 2:
             return 1
         
-        total_interval = sum(abs(indices[i] - indices[i-1]) for i in range(1, len(indices)))
-        avg_interval = total_interval / (len(indices) - 1)
-        
         # Difficulty formula (subjective, can be refined)
         if length <= 5 and avg_interval <= 2:
             return 1
@@ -285,6 +379,7 @@ class MTDETL:
         print("MTD ETL Pipeline Complete")
         print('='*60)
         print(f"Total themes:     {self.stats.total_files}")
+        print(f"Prefiltered:      {self.stats.prefiltered} (composer from filename, not parsed)")
         print(f"Successfully parsed: {self.stats.parsed}")
         print(f"Inserted to DB:   {self.stats.inserted}")
         print(f"Duplicates:       {self.stats.duplicates}")
@@ -306,41 +401,34 @@ def clean_database(db_path: Path = DB_PATH):
         print(f"⚠️  Database not found: {db_path}")
         return
     
-    conn = sqlite3.connect(db_path)
+    # Autocommit connection: the script below controls its own transaction
+    conn = connect(db_path)
     cursor = conn.cursor()
     
     try:
-        # Delete all user progress first (references puzzles)
-        cursor.execute("DELETE FROM user_progress")
-        
-        # Delete all puzzles
-        cursor.execute("DELETE FROM puzzles")
-        
-        # Delete all motif-tag links (many-to-many)
-        cursor.execute("DELETE FROM motif_tags")
-        
-        # Delete all motifs
-        cursor.execute("DELETE FROM motifs")
-        
-        # Delete all sources
-        cursor.execute("DELETE FROM sources")
-        
-        # Delete all tags
-        cursor.execute("DELETE FROM tags")
-        
-        conn.commit()
+        # Delete in dependency order: user progress references puzzles,
+        # motif-tag links reference motifs and tags
+        cursor.executescript("""
+            BEGIN IMMEDIATE;
+            DELETE FROM user_progress;
+            DELETE FROM puzzles;
+            DELETE FROM motif_tags;
+            DELETE FROM motifs;
+            DELETE FROM sources;
+            DELETE FROM tags;
+            COMMIT;
+        """)
         
         # Verify cleanup
-        cursor.execute("SELECT COUNT(*) FROM motifs")
-        motif_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM motif_tags")
-        tag_link_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM sources")
-        source_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM tags")
-        tag_count = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM puzzles")
-        puzzle_count = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM motifs),
+                (SELECT COUNT(*) FROM motif_tags),
+                (SELECT COUNT(*) FROM sources),
+                (SELECT COUNT(*) FROM tags),
+                (SELECT COUNT(*) FROM puzzles)
+        """)
+        motif_count, tag_link_count, source_count, tag_count, puzzle_count = cursor.fetchone()
         
         print(f"✅ Database cleaned")
         print(f"   Remaining motifs: {motif_count}")
@@ -351,7 +439,8 @@ def clean_database(db_path: Path = DB_PATH):
         
     except Exception as e:
         print(f"❌ Error cleaning database: {e}")
-        conn.rollback()
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
         raise
     finally:
         conn.close()
@@ -4,15 +4,25 @@ Import 50 recognizable musical themes into the music crossword database.
 Converts from the React component format to the database schema format.
 """
 
-import sqlite3
-import json
-import hashlib
 import re
+from functools import lru_cache
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "music_crossword.db"
+from db import DB_PATH, connect
+from theme_utils import checksum, load_json
+
 JSON_PATH = Path(__file__).parent.parent / "nonessential/data/musical_themes_database.json"
 
+# Single motif INSERT; executemany prepares it once for the whole batch
+INSERT_MOTIF_SQL = """
+    INSERT OR IGNORE INTO motifs (
+        pitch_sequence, rhythm_sequence, interval_profile, length,
+        allowed_transpositions, first_pitch, last_pitch,
+        source_id, descriptor, difficulty, recognition_score,
+        checksum
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
 # Conversion table: duration fractions to Kern notation
 DURATION_TO_KERN = {
     2.0: "1",     # Double whole note (breve)
@@ -25,6 +35,44 @@ DURATION_TO_KERN = {
     0.17: "16",   # Sixteenth note (approximate)
 }
 
+# Pitch class to semitone offset within an octave
+NOTE_TO_SEMITONE = {
+    'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
+    'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
+    'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
+}
+
+# Semitone offset to pitch class (sharps only)
+SEMITONE_TO_NOTE = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+
+# Genre keywords, checked in order; the first genre with a matching keyword wins
+GENRE_KEYWORDS = [
+    ('traditional_holiday', ['christmas', 'jingle', 'silent night', 'rudolph', 'deck']),
+    ('film_tv', ['star wars', 'harry potter', 'pirates', 'bond', 'mission', 'thrones', 'simpsons', 'addams', 'indiana']),
+    ('game', ['mario', 'tetris', 'nokia']),
+    ('classical', ['beethoven', 'mozart', 'für elise', 'ode to joy', 'canon', 'eine kleine', 'entertainer', 'wedding march']),
+    ('rock', ['rock you', 'nation army', 'smoke on the water', 'black', 'child']),
+    ('traditional_folk', ['happy birthday', 'twinkle', 'mary', 'old macdonald', 'frère', 'yankee', 'amazing grace', 'auld', 'greensleeves', 'camptown', 'susanna', 'london bridge', 'this old man']),
+]
+
+# Recognition tiers (score, phrases), checked from most to least famous
+RECOGNITION_KEYWORDS = [
+    (10, ['happy birthday', 'star wars', 'imperial march', 'super mario', 'für elise', 'ode to joy', 'jingle bells', 'twinkle']),
+    (9, ['harry potter', 'james bond', 'mission impossible', 'tetris', 'beethoven', 'pirates caribbean', 'game of thrones']),
+    (8, ['pink panther', 'wedding march', 'amazing grace', 'silent night', 'canon']),
+    (7, ['seven nation', 'smoke on the water', 'greensleeves', 'yankee doodle']),
+]
+
+def compile_keyword_pattern(words):
+    """Compile a keyword list into one alternation matching any of the words."""
+    return re.compile('|'.join(map(re.escape, words)))
+
+GENRE_PATTERNS = [(genre, compile_keyword_pattern(words)) for genre, words in GENRE_KEYWORDS]
+RECOGNITION_PATTERNS = [(score, compile_keyword_pattern(words)) for score, words in RECOGNITION_KEYWORDS]
+
+PITCH_CLASS_PATTERN = re.compile(r'^([A-G][#b]*)')
+OCTAVE_PATTERN = re.compile(r'(\d+)$')
+
 def convert_note_to_pitch_class(note_with_octave):
     """Convert 'C4' to 'C', 'D#5' to 'D#', etc."""
     # Remove octave number (last character or last two if note ends with number)
@@ -39,51 +87,26 @@ def convert_duration_to_kern(duration):
     closest = min(DURATION_TO_KERN.keys(), key=lambda x: abs(x - duration))
     return DURATION_TO_KERN[closest]
 
-def extract_pitch_class(note: str) -> str:
-    """Extract pitch class from note with octave (C4 -> C, D#5 -> D#)."""
-    import re
-    match = re.search(r'^([A-G][#b]*)', note)
-    return match.group(1) if match else note
-
-def extract_octave(note: str) -> int:
-    """Extract octave number from note (C4 -> 4, D#5 -> 5)."""
-    import re
-    match = re.search(r'(\d+)$', note)
-    return int(match.group(1)) if match else 4
+@lru_cache(maxsize=4096)
+def parse_note(note: str) -> tuple:
+    """Split a note into (pitch_class, octave, semitone), e.g. 'D#5' -> ('D#', 5, 63)."""
+    match = PITCH_CLASS_PATTERN.match(note)
+    pitch_class = match.group(1) if match else note
+    match = OCTAVE_PATTERN.search(note)
+    octave = int(match.group(1)) if match else 4
+    return pitch_class, octave, NOTE_TO_SEMITONE.get(pitch_class, 0) + octave * 12
 
 def calculate_interval_profile(pitch_sequence):
     """Calculate interval sequence (semitones between consecutive notes, accounting for octaves)."""
-    note_to_semitone = {
-        'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
-        'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
-        'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
-    }
+    # Convert each note to an absolute semitone value once, then diff neighbours
+    semitones = [parse_note(note)[2] for note in pitch_sequence.split()]
     
-    notes = pitch_sequence.split()
-    intervals = []
-    
-    for i in range(len(notes) - 1):
-        current_note = notes[i]
-        next_note = notes[i + 1]
-        
-        current_pitch = extract_pitch_class(current_note)
-        current_octave = extract_octave(current_note)
-        next_pitch = extract_pitch_class(next_note)
-        next_octave = extract_octave(next_note)
-        
-        # Calculate semitones including octave
-        current_semi = note_to_semitone.get(current_pitch, 0) + current_octave * 12
-        next_semi = note_to_semitone.get(next_pitch, 0) + next_octave * 12
-        interval = next_semi - current_semi
-        
-        intervals.append(f"{interval:+d}")
-    
-    return " ".join(intervals)
+    return " ".join(f"{b - a:+d}" for a, b in zip(semitones, semitones[1:]))
 
 def calculate_checksum(pitch_sequence):
     """Calculate SHA256 checksum of normalized pitch sequence."""
     normalized = " ".join(pitch_sequence.split()).lower()
-    return hashlib.sha256(normalized.encode()).hexdigest()
+    return checksum(normalized)
 
 def transpose_to_2_octaves(pitch_sequence: str) -> str:
     """
@@ -94,26 +117,8 @@ def transpose_to_2_octaves(pitch_sequence: str) -> str:
     if not notes:
         return pitch_sequence
     
-    note_to_semitone = {
-        'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
-        'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
-        'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
-    }
-    
     # Find the lowest and highest MIDI note numbers
-    midi_numbers = []
-    pitch_classes = []
-    for note in notes:
-        pitch_class = extract_pitch_class(note)
-        octave = extract_octave(note)
-        pitch_semi = note_to_semitone.get(pitch_class, 0)
-        midi_num = pitch_semi + octave * 12
-        midi_numbers.append(midi_num)
-        pitch_classes.append(pitch_class)
-    
-    if not midi_numbers:
-        return pitch_sequence
-    
+    midi_numbers = [parse_note(note)[2] for note in notes]
     min_midi = min(midi_numbers)
     max_midi = max(midi_numbers)
     range_semitones = max_midi - min_midi
@@ -132,49 +137,19 @@ def transpose_to_2_octaves(pitch_sequence: str) -> str:
         # Range too large, shift to start at C4 and clamp high notes
         shift = target_min - min_midi
     
-    # Apply shift and clamp to C4-C5 range
-    result = []
-    reverse_map = {0: 'C', 1: 'C#', 2: 'D', 3: 'D#', 4: 'E', 5: 'F',
-                  6: 'F#', 7: 'G', 8: 'G#', 9: 'A', 10: 'A#', 11: 'B'}
-    
-    for i, note in enumerate(notes):
-        pitch_class = pitch_classes[i]
-        midi_num = midi_numbers[i]
-        new_midi = midi_num + shift
-        
-        # Clamp to C4-B5 range (MIDI 60-83)
-        if new_midi < 60:
-            new_midi = 60
-        elif new_midi > 83:
-            new_midi = 83
-        
-        # Convert back to note with octave
-        new_octave = new_midi // 12
-        new_pitch_semi = new_midi % 12
-        new_pitch_class = reverse_map.get(new_pitch_semi, pitch_class)
-        
-        result.append(f"{new_pitch_class}{new_octave}")
-    
-    return " ".join(result)
+    # Apply shift, clamp to C4-B5 range and convert back to note with octave
+    shifted = (min(max(midi_num + shift, target_min), target_max) for midi_num in midi_numbers)
+    return " ".join(f"{SEMITONE_TO_NOTE[midi_num % 12]}{midi_num // 12}" for midi_num in shifted)
 
 def categorize_song(name):
     """Categorize song by genre based on name."""
     name_lower = name.lower()
     
-    if any(word in name_lower for word in ['christmas', 'jingle', 'silent night', 'rudolph', 'deck']):
-        return 'traditional_holiday'
-    elif any(word in name_lower for word in ['star wars', 'harry potter', 'pirates', 'bond', 'mission', 'thrones', 'simpsons', 'addams', 'indiana']):
-        return 'film_tv'
-    elif any(word in name_lower for word in ['mario', 'tetris', 'nokia']):
-        return 'game'
-    elif any(word in name_lower for word in ['beethoven', 'mozart', 'für elise', 'ode to joy', 'canon', 'eine kleine', 'entertainer', 'wedding march']):
-        return 'classical'
-    elif any(word in name_lower for word in ['rock you', 'nation army', 'smoke on the water', 'black', 'child']):
-        return 'rock'
-    elif any(word in name_lower for word in ['happy birthday', 'twinkle', 'mary', 'old macdonald', 'frère', 'yankee', 'amazing grace', 'auld', 'greensleeves', 'camptown', 'susanna', 'london bridge', 'this old man']):
-        return 'traditional_folk'
-    else:
-        return 'popular'
+    for genre, pattern in GENRE_PATTERNS:
+        if pattern.search(name_lower):
+            return genre
+    
+    return 'popular'
 
 def estimate_difficulty(length, tempo, note_range):
     """Estimate difficulty from 1-5."""
@@ -200,21 +175,9 @@ def estimate_recognition_score(name):
     """Estimate how recognizable the song is (1-10)."""
     name_lower = name.lower()
     
-    # Super famous (10/10)
-    if any(phrase in name_lower for phrase in ['happy birthday', 'star wars', 'imperial march', 'super mario', 'für elise', 'ode to joy', 'jingle bells', 'twinkle']):
-        return 10
-    
-    # Very famous (9/10)
-    if any(phrase in name_lower for phrase in ['harry potter', 'james bond', 'mission impossible', 'tetris', 'beethoven', 'pirates caribbean', 'game of thrones']):
-        return 9
-    
-    # Well known (8/10)
-    if any(phrase in name_lower for phrase in ['pink panther', 'wedding march', 'amazing grace', 'silent night', 'canon']):
-        return 8
-    
-    # Known (7/10)
-    if any(phrase in name_lower for phrase in ['seven nation', 'smoke on the water', 'greensleeves', 'yankee doodle']):
-        return 7
+    for score, pattern in RECOGNITION_PATTERNS:
+        if pattern.search(name_lower):
+            return score
     
     # Moderate (6/10)
     return 6
@@ -232,71 +195,74 @@ def import_themes():
         return
     
     # Load JSON data
-    with open(JSON_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(JSON_PATH)
     
     themes = data['themes']
     print(f"📚 Loaded {len(themes)} themes from {JSON_PATH}")
     
-    # Connect to database
-    conn = sqlite3.connect(DB_PATH)
+    # Connect in autocommit mode so the import runs as one explicit transaction
+    conn = connect(DB_PATH)
     cursor = conn.cursor()
     
-    # Ensure "Curated Popular Songs" source exists
-    cursor.execute("""
-        INSERT OR IGNORE INTO sources (name, region, collection, license, notes)
-        VALUES (?, ?, ?, ?, ?)
-    """, (
-        "Curated Popular Songs",
-        "International",
-        "50 Recognizable Themes",
-        "Mixed - see individual themes",
-        "Hand-curated collection of 50 highly recognizable songs for crossword puzzles"
-    ))
-    
-    cursor.execute("SELECT id FROM sources WHERE name = ?", ("Curated Popular Songs",))
-    source_id = cursor.fetchone()[0]
-    
-    imported_count = 0
-    skipped_count = 0
-    
-    for theme in themes:
-        # Keep notes with octaves, but transpose to fit within C4-C5 (2 octaves)
-        original_sequence = " ".join(theme['notes'])
-        # Transpose to fit within 2 octaves (C4-C5)
-        pitch_sequence = transpose_to_2_octaves(original_sequence)
-        
-        # Convert durations to Kern notation
-        rhythm_sequence = " ".join([convert_duration_to_kern(dur) for dur in theme['durations']])
-        
-        # Calculate interval profile (with octaves)
-        interval_profile = calculate_interval_profile(pitch_sequence)
-        
-        # Extract metadata
-        length = len(theme['notes'])
-        first_pitch = pitch_sequence.split()[0] if pitch_sequence else None
-        last_pitch = pitch_sequence.split()[-1] if pitch_sequence else None
-        
-        # Calculate checksum
-        checksum = calculate_checksum(pitch_sequence)
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
         
-        # Categorize and estimate metrics
-        genre = categorize_song(theme['name'])
-        difficulty = estimate_difficulty(length, theme['tempo'], pitch_sequence)
-        recognition_score = estimate_recognition_score(theme['name'])
+        # Ensure "Curated Popular Songs" source exists and get its id in one statement
+        # (the no-op DO UPDATE makes RETURNING yield the existing row on conflict)
+        cursor.execute("""
+            INSERT INTO sources (name, region, collection, license, notes)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET name = excluded.name
+            RETURNING id
+        """, (
+            "Curated Popular Songs",
+            "International",
+            "50 Recognizable Themes",
+            "Mixed - see individual themes",
+            "Hand-curated collection of 50 highly recognizable songs for crossword puzzles"
+        ))
+        source_id = cursor.fetchone()[0]
         
-        # Prepare descriptor with BPM info
-        descriptor = f"{theme['name']} ({theme['tempo']} BPM)"
+        # Checksums already in the database; duplicates are skipped before insert
+        cursor.execute("SELECT checksum FROM motifs WHERE checksum IS NOT NULL")
+        seen_checksums = {row[0] for row in cursor}
+        motif_rows = []
+        skipped_count = 0
         
-        try:
-            cursor.execute("""
-                INSERT INTO motifs (
-                    pitch_sequence, rhythm_sequence, interval_profile, length,
-                    allowed_transpositions, first_pitch, last_pitch,
-                    source_id, descriptor, difficulty, recognition_score,
-                    checksum
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+        for theme in themes:
+            # Keep notes with octaves, but transpose to fit within C4-C5 (2 octaves)
+            original_sequence = " ".join(theme['notes'])
+            # Transpose to fit within 2 octaves (C4-C5)
+            pitch_sequence = transpose_to_2_octaves(original_sequence)
+            
+            # Calculate checksum
+            motif_checksum = calculate_checksum(pitch_sequence)
+            if motif_checksum in seen_checksums:
+                skipped_count += 1
+                print(f"⏭️  Skipped {theme['name']} (duplicate)")
+                continue
+            seen_checksums.add(motif_checksum)
+            
+            # Convert durations to Kern notation
+            rhythm_sequence = " ".join([convert_duration_to_kern(dur) for dur in theme['durations']])
+            
+            # Calculate interval profile (with octaves)
+            interval_profile = calculate_interval_profile(pitch_sequence)
+            
+            # Extract metadata
+            length = len(theme['notes'])
+            first_pitch = pitch_sequence.split()[0] if pitch_sequence else None
+            last_pitch = pitch_sequence.split()[-1] if pitch_sequence else None
+            
+            # Categorize and estimate metrics
+            genre = categorize_song(theme['name'])
+            difficulty = estimate_difficulty(length, theme['tempo'], pitch_sequence)
+            recognition_score = estimate_recognition_score(theme['name'])
+            
+            # Prepare descriptor with BPM info
+            descriptor = f"{theme['name']} ({theme['tempo']} BPM)"
+            
+            motif_rows.append((
                 pitch_sequence,
                 rhythm_sequence,
                 interval_profile,
@@ -308,60 +274,67 @@ def import_themes():
                 descriptor,
                 difficulty,
                 recognition_score,
-                checksum
+                motif_checksum
             ))
-            
-            imported_count += 1
             print(f"✅ {theme['name']} (ID: {theme['id']}, Length: {length}, Difficulty: {difficulty}, Recognition: {recognition_score})")
-            
-        except sqlite3.IntegrityError as e:
-            skipped_count += 1
-            print(f"⏭️  Skipped {theme['name']} (duplicate)")
-    
-    # Commit changes
-    conn.commit()
-    
-    # Show summary
-    print(f"\n{'='*60}")
-    print(f"✅ Import complete!")
-    print(f"   Imported: {imported_count} themes")
-    print(f"   Skipped: {skipped_count} duplicates")
-    print(f"   Total in database: ", end="")
-    
-    cursor.execute("SELECT COUNT(*) FROM motifs")
-    total = cursor.fetchone()[0]
-    print(f"{total} motifs")
-    
-    # Show category breakdown
-    print(f"\n📊 Category breakdown:")
-    cursor.execute("""
-        SELECT 
-            CASE 
-                WHEN descriptor LIKE '%Christmas%' OR descriptor LIKE '%Jingle%' 
-                    OR descriptor LIKE '%Silent Night%' OR descriptor LIKE '%Rudolph%' 
-                    OR descriptor LIKE '%Deck%' THEN 'Holiday'
-                WHEN descriptor LIKE '%Star Wars%' OR descriptor LIKE '%Harry Potter%' 
-                    OR descriptor LIKE '%Pirates%' OR descriptor LIKE '%Bond%' 
-                    OR descriptor LIKE '%Thrones%' OR descriptor LIKE '%Simpsons%' THEN 'Film/TV'
-                WHEN descriptor LIKE '%Mario%' OR descriptor LIKE '%Tetris%' 
-                    OR descriptor LIKE '%Nokia%' THEN 'Games'
-                WHEN descriptor LIKE '%Beethoven%' OR descriptor LIKE '%Mozart%' 
-                    OR descriptor LIKE '%Elise%' OR descriptor LIKE '%Canon%' THEN 'Classical'
-                WHEN descriptor LIKE '%Rock%' OR descriptor LIKE '%Nation%' 
-                    OR descriptor LIKE '%Smoke%' OR descriptor LIKE '%Black%' THEN 'Rock'
-                ELSE 'Traditional/Folk'
-            END as category,
-            COUNT(*) as count
-        FROM motifs
-        WHERE source_id = ?
-        GROUP BY category
-        ORDER BY count DESC
-    """, (source_id,))
-    
-    for row in cursor.fetchall():
-        print(f"   {row[0]}: {row[1]} songs")
+        
+        # Insert all new motifs in one batch
+        cursor.executemany(INSERT_MOTIF_SQL, motif_rows)
+        
+        imported_count = cursor.rowcount
+        skipped_count += len(motif_rows) - imported_count
+        
+        # Commit changes
+        cursor.execute("COMMIT")
+        
+        # Show summary
+        print(f"\n{'='*60}")
+        print(f"✅ Import complete!")
+        print(f"   Imported: {imported_count} themes")
+        print(f"   Skipped: {skipped_count} duplicates")
+        print(f"   Total in database: ", end="")
+        
+        cursor.execute("SELECT COUNT(*) FROM motifs")
+        total = cursor.fetchone()[0]
+        print(f"{total} motifs")
+        
+        # Show category breakdown
+        print(f"\n📊 Category breakdown:")
+        cursor.execute("""
+            SELECT 
+                CASE 
+                    WHEN descriptor LIKE '%Christmas%' OR descriptor LIKE '%Jingle%' 
+                        OR descriptor LIKE '%Silent Night%' OR descriptor LIKE '%Rudolph%' 
+                        OR descriptor LIKE '%Deck%' THEN 'Holiday'
+                    WHEN descriptor LIKE '%Star Wars%' OR descriptor LIKE '%Harry Potter%' 
+                        OR descriptor LIKE '%Pirates%' OR descriptor LIKE '%Bond%' 
+                        OR descriptor LIKE '%Thrones%' OR descriptor LIKE '%Simpsons%' THEN 'Film/TV'
+                    WHEN descriptor LIKE '%Mario%' OR descriptor LIKE '%Tetris%' 
+                        OR descriptor LIKE '%Nokia%' THEN 'Games'
+                    WHEN descriptor LIKE '%Beethoven%' OR descriptor LIKE '%Mozart%' 
+                        OR descriptor LIKE '%Elise%' OR descriptor LIKE '%Canon%' THEN 'Classical'
+                    WHEN descriptor LIKE '%Rock%' OR descriptor LIKE '%Nation%' 
+                        OR descriptor LIKE '%Smoke%' OR descriptor LIKE '%Black%' THEN 'Rock'
+                    ELSE 'Traditional/Folk'
+                END as category,
+                COUNT(*) as count
+            FROM motifs
+            WHERE source_id = ?
+            GROUP BY category
+            ORDER BY count DESC
+        """, (source_id,))
+        
+        for row in cursor.fetchall():
+            print(f"   {row[0]}: {row[1]} songs")
+        
+    except Exception as e:
+        print(f"❌ Import failed: {e}")
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
     
-    conn.close()
     print(f"\n🎵 Database ready at {DB_PATH}")
 
 if __name__ == "__main__":
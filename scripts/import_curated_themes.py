@@ -4,14 +4,33 @@ Import curated themes from curated_themes.json into the database.
 These are hand-picked, highly recognizable musical themes.
 """
 
-import sqlite3
-import json
-import hashlib
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent.parent / "music_crossword.db"
+from db import DB_PATH, connect
+from theme_utils import INTERVAL_TOKENS, checksum, load_json
+
 THEMES_PATH = Path(__file__).parent.parent / "nonessential/data/curated_themes.json"
 
+# Pitch class to 12-tone chromatic index (C=0 ... B=11)
+PITCH_MAP = {
+    'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
+    'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
+    'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
+}
+
+# SQL used by the import, defined once so each statement is prepared once per batch
+INSERT_MOTIF_SQL = """
+    INSERT OR IGNORE INTO motifs (
+        pitch_sequence, rhythm_sequence, interval_profile, length,
+        allowed_transpositions, first_pitch, last_pitch,
+        source_id, original_filename, descriptor,
+        license, difficulty, recognition_score, checksum
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SELECT_TAGS_SQL = "SELECT name, id FROM tags WHERE name IN ({placeholders})"
+INSERT_TAG_SQL = "INSERT INTO tags (name, category) VALUES (?, ?)"
+INSERT_MOTIF_TAG_SQL = "INSERT OR IGNORE INTO motif_tags (motif_id, tag_id) VALUES (?, ?)"
+
 def import_curated_themes():
     """Import curated themes from JSON file."""
     
@@ -20,162 +39,152 @@ def import_curated_themes():
         print(f"❌ File not found: {THEMES_PATH}")
         return
     
-    with open(THEMES_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(THEMES_PATH)
     
     themes = data['themes']
     print(f"📚 Loaded {len(themes)} curated themes")
     
     # Connect to database
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect(DB_PATH)
     cursor = conn.cursor()
     
-    # Get or create "Curated Themes" source
-    cursor.execute("""
-        SELECT id FROM sources WHERE name = 'Curated Themes - Iconic Melodies'
-    """)
-    row = cursor.fetchone()
-    
-    if row:
-        source_id = row[0]
-    else:
+    try:
+        # Run the whole import (source, motifs, tags) in a single write transaction
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Get or create "Curated Themes" source
         cursor.execute("""
-            INSERT INTO sources (name, region, collection, license, url, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            'Curated Themes - Iconic Melodies',
-            'Various',
-            'curated',
-            'Various - see individual entries',
-            'https://github.com/tevzs/dap-projekt',
-            'Hand-curated collection of the most recognizable musical themes'
-        ))
-        source_id = cursor.lastrowid
-        print(f"✅ Created source: Curated Themes (ID: {source_id})")
-    
-    # Import each theme
-    inserted = 0
-    duplicates = 0
-    errors = 0
-    
-    for theme in themes:
-        try:
-            # Extract data
-            pitch_sequence = theme['pitch_sequence']
-            rhythm_sequence = theme.get('rhythm_sequence', None)  # Optional, for backwards compatibility
-            length = theme['length']
-            descriptor = theme['title']
-            recognition_score = theme['recognition_score']
-            difficulty = theme['difficulty']
-            
-            # Compute interval profile
-            pitch_map = {
-                'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
-                'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
-                'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
-            }
-            
-            pitches = pitch_sequence.split()
-            indices = [pitch_map[p] for p in pitches]
-            
-            intervals = []
-            for i in range(1, len(indices)):
-                diff = indices[i] - indices[i-1]
-                intervals.append(f"{diff:+d}")
-            interval_profile = " ".join(intervals)
-            
-            # First and last pitch
-            first_pitch = pitches[0] if pitches else None
-            last_pitch = pitches[-1] if pitches else None
-            
-            # Checksum
-            checksum = hashlib.sha256(pitch_sequence.encode()).hexdigest()
-            
-            # Insert
+            SELECT id FROM sources WHERE name = 'Curated Themes - Iconic Melodies'
+        """)
+        row = cursor.fetchone()
+        
+        if row:
+            source_id = row[0]
+        else:
             cursor.execute("""
-                INSERT INTO motifs (
-                    pitch_sequence, rhythm_sequence, interval_profile, length,
-                    allowed_transpositions, first_pitch, last_pitch,
-                    source_id, original_filename, descriptor,
-                    license, difficulty, recognition_score, checksum
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO sources (name, region, collection, license, url, notes)
+                VALUES (?, ?, ?, ?, ?, ?)
             """, (
-                pitch_sequence,
-                rhythm_sequence,
-                interval_profile,
-                length,
-                '*',  # All transpositions allowed
-                first_pitch,
-                last_pitch,
-                source_id,
-                f"{theme['id']}.json",
-                descriptor,
-                'Various - see source',
-                difficulty,
-                recognition_score,
-                checksum
+                'Curated Themes - Iconic Melodies',
+                'Various',
+                'curated',
+                'Various - see individual entries',
+                'https://github.com/tevzs/dap-projekt',
+                'Hand-curated collection of the most recognizable musical themes'
             ))
-            
-            inserted += 1
-            
-            # Add genre tag
-            motif_id = cursor.lastrowid
-            genre = theme.get('genre', 'classical')
-            
-            # Get or create genre tag
-            cursor.execute("SELECT id FROM tags WHERE name = ?", (genre,))
-            tag_row = cursor.fetchone()
-            
-            if tag_row:
-                tag_id = tag_row[0]
-            else:
-                cursor.execute("""
-                    INSERT INTO tags (name, category)
-                    VALUES (?, 'genre')
-                """, (genre,))
-                tag_id = cursor.lastrowid
-            
-            # Link motif to tag
+            source_id = cursor.lastrowid
+            print(f"✅ Created source: Curated Themes (ID: {source_id})")
+        
+        # Checksums already in the database, used to skip duplicates before inserting
+        cursor.execute("SELECT checksum FROM motifs WHERE checksum IS NOT NULL")
+        seen_checksums = {r[0] for r in cursor}
+        
+        # Build all motif rows first, then insert them in one batch
+        motif_rows = []
+        motif_tag_names = []  # (checksum, [tag names]) for each queued motif
+        tag_categories = {}   # tag name -> category for tags created by this import
+        duplicates = 0
+        errors = 0
+        
+        for theme in themes:
             try:
-                cursor.execute("""
-                    INSERT INTO motif_tags (motif_id, tag_id)
-                    VALUES (?, ?)
-                """, (motif_id, tag_id))
-            except sqlite3.IntegrityError:
-                pass  # Already tagged
-            
-            # Add composer tag if present
-            if 'composer' in theme:
-                composer = theme['composer']
-                cursor.execute("SELECT id FROM tags WHERE name = ?", (composer,))
-                comp_row = cursor.fetchone()
+                # Extract data
+                pitch_sequence = theme['pitch_sequence']
+                rhythm_sequence = theme.get('rhythm_sequence', None)  # Optional, for backwards compatibility
+                length = theme['length']
+                descriptor = theme['title']
+                recognition_score = theme['recognition_score']
+                difficulty = theme['difficulty']
                 
-                if comp_row:
-                    comp_tag_id = comp_row[0]
-                else:
-                    cursor.execute("""
-                        INSERT INTO tags (name, category)
-                        VALUES (?, 'composer')
-                    """, (composer,))
-                    comp_tag_id = cursor.lastrowid
+                # Compute interval profile
+                pitches = pitch_sequence.split()
+                indices = [PITCH_MAP[p] for p in pitches]
+                interval_profile = " ".join(INTERVAL_TOKENS[b - a + 11] for a, b in zip(indices, indices[1:]))
                 
-                try:
-                    cursor.execute("""
-                        INSERT INTO motif_tags (motif_id, tag_id)
-                        VALUES (?, ?)
-                    """, (motif_id, comp_tag_id))
-                except sqlite3.IntegrityError:
-                    pass
+                # First and last pitch
+                first_pitch = pitches[0] if pitches else None
+                last_pitch = pitches[-1] if pitches else None
+                
+                # Checksum for duplicate detection
+                motif_checksum = checksum(pitch_sequence)
+                
+                if motif_checksum in seen_checksums:
+                    duplicates += 1
+                    continue
+                seen_checksums.add(motif_checksum)
+                
+                motif_rows.append((
+                    pitch_sequence,
+                    rhythm_sequence,
+                    interval_profile,
+                    length,
+                    '*',  # All transpositions allowed
+                    first_pitch,
+                    last_pitch,
+                    source_id,
+                    f"{theme['id']}.json",
+                    descriptor,
+                    'Various - see source',
+                    difficulty,
+                    recognition_score,
+                    motif_checksum
+                ))
+                
+                # Genre tag, plus composer tag if present
+                genre = theme.get('genre', 'classical')
+                tag_categories.setdefault(genre, 'genre')
+                tag_names = [genre]
+                if 'composer' in theme:
+                    tag_categories.setdefault(theme['composer'], 'composer')
+                    tag_names.append(theme['composer'])
+                motif_tag_names.append((motif_checksum, tag_names))
+                
+            except Exception as e:
+                print(f"⚠️  Error importing {theme.get('title', 'unknown')}: {e}")
+                errors += 1
+        
+        # Insert all new motifs at once
+        cursor.executemany(INSERT_MOTIF_SQL, motif_rows)
+        inserted = cursor.rowcount
+        # Rows ignored by the checksum constraint were already in the database
+        duplicates += len(motif_rows) - inserted
+        
+        # Map checksums back to the new motif ids for tag linking
+        cursor.execute("SELECT checksum, id FROM motifs WHERE source_id = ?", (source_id,))
+        motif_ids = dict(cursor.fetchall())
+        
+        # Resolve tag ids once, creating any missing tags in one batch
+        tag_ids = {}
+        if tag_categories:
+            names = list(tag_categories)
+            placeholders = ", ".join("?" * len(names))
+            select_tags_sql = SELECT_TAGS_SQL.format(placeholders=placeholders)
+            cursor.execute(select_tags_sql, names)
+            tag_ids = dict(cursor.fetchall())
             
-        except sqlite3.IntegrityError:
-            duplicates += 1
-        except Exception as e:
-            print(f"⚠️  Error importing {theme.get('title', 'unknown')}: {e}")
-            errors += 1
-    
-    # Commit
-    conn.commit()
-    conn.close()
+            missing = [(name, tag_categories[name]) for name in names if name not in tag_ids]
+            if missing:
+                cursor.executemany(INSERT_TAG_SQL, missing)
+                cursor.execute(select_tags_sql, names)
+                tag_ids = dict(cursor.fetchall())
+        
+        # Link motifs to tags (skipping any motif ignored as a duplicate)
+        cursor.executemany(INSERT_MOTIF_TAG_SQL, [
+            (motif_ids[checksum], tag_ids[name])
+            for checksum, tag_names in motif_tag_names
+            if checksum in motif_ids
+            for name in tag_names
+        ])
+        
+        # Commit
+        cursor.execute("COMMIT")
+    except Exception as e:
+        print(f"❌ Import failed: {e}")
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
     
     # Report
     print(f"\n{'='*60}")
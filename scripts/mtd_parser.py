@@ -5,25 +5,51 @@ Extracts pitch sequences and metadata for the music crossword database.
 """
 
 import csv
-import json
+import os
+import threading
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, NamedTuple, Optional, Dict
 from dataclasses import dataclass
 
+from theme_utils import INTERVAL_TOKENS, load_json
 
-@dataclass
+
+def duration_to_kern(duration: float) -> str:
+    """Approximate a duration in seconds as a Kern note value (typical tempo)."""
+    if duration >= 0.9:
+        return "2"  # Half note
+    elif duration >= 0.4:
+        return "4"  # Quarter note
+    elif duration >= 0.2:
+        return "8"  # Eighth note
+    elif duration >= 0.1:
+        return "16"  # Sixteenth note
+    else:
+        return "32"  # Thirty-second note
+
+
+class ThemeSummary(NamedTuple):
+    """Per-theme values derived from the notes (see MTDTheme.summarize)."""
+    pitch_sequence: str
+    rhythm_sequence: str
+    interval_profile: str
+    avg_interval: float  # Mean absolute interval in semitones (0.0 for < 2 notes)
+
+
+@dataclass(slots=True, frozen=True)
 class MTDNote:
     """Represents a single note from MTD CSV."""
     pitch_midi: int      # MIDI pitch number (60 = C4)
     start_time: float   # Start time in seconds
     duration: float     # Duration in seconds
     
+    # Pitch class names indexed by MIDI pitch % 12 (MIDI 60 = C4, 61 = C#4, etc.)
+    PITCH_CLASSES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+    
     @property
     def pitch_class(self) -> str:
         """Convert MIDI pitch to pitch class (C, D, E, etc.)."""
-        # MIDI 60 = C4, 61 = C#4, etc.
-        pitch_classes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        return pitch_classes[self.pitch_midi % 12]
+        return self.PITCH_CLASSES[self.pitch_midi % 12]
     
     @property
     def octave(self) -> int:
@@ -31,7 +57,7 @@ class MTDNote:
         return (self.pitch_midi // 12) - 1
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MTDTheme:
     """Represents a complete MTD theme."""
     mtd_id: str
@@ -42,55 +68,37 @@ class MTDTheme:
     notes: List[MTDNote]
     metadata: Dict
     
-    def to_pitch_sequence(self) -> str:
-        """Convert to space-separated pitch classes."""
-        return " ".join(note.pitch_class for note in self.notes)
-    
-    def to_rhythm_sequence(self) -> str:
+    def summarize(self) -> ThemeSummary:
         """
-        Convert durations to Kern-like notation.
-        Approximates seconds to note values: 0.5s ≈ quarter, 0.25s ≈ eighth, etc.
+        Compute the pitch, rhythm and interval data for the database row in a
+        single pass over the notes:
+        - pitch_sequence: space-separated pitch classes ("C D E")
+        - rhythm_sequence: Kern-like durations (0.5s ≈ quarter, 0.25s ≈ eighth, ...)
+        - interval_profile: signed semitone steps between 12-tone chromatic
+          indices (C=0 ... B=11), e.g. "C D E" -> "+2 +2"
+        - avg_interval: mean absolute step size
         """
+        pitch_classes = MTDNote.PITCH_CLASSES
+        pitches = []
         rhythms = []
-        for note in self.notes:
-            # Approximate conversion based on typical tempo
-            if note.duration >= 0.9:
-                rhythms.append("2")  # Half note
-            elif note.duration >= 0.4:
-                rhythms.append("4")  # Quarter note
-            elif note.duration >= 0.2:
-                rhythms.append("8")  # Eighth note
-            elif note.duration >= 0.1:
-                rhythms.append("16")  # Sixteenth note
-            else:
-                rhythms.append("32")  # Thirty-second note
-        return " ".join(rhythms)
-    
-    def to_pitch_indices(self) -> List[int]:
-        """
-        Convert notes to 12-tone chromatic indices (C=0, C#=1, D=2, ..., B=11).
-        Returns list of integers for interval calculations.
-        """
-        chromatic_map = {
-            'C': 0, 'C#': 1, 'Db': 1, 'D': 2, 'D#': 3, 'Eb': 3,
-            'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'G': 7, 'G#': 8,
-            'Ab': 8, 'A': 9, 'A#': 10, 'Bb': 10, 'B': 11
-        }
-        return [chromatic_map[note.pitch_class] for note in self.notes]
-    
-    def compute_interval_profile(self) -> str:
-        """
-        Compute interval profile as space-separated semitone differences.
-        E.g., "C D E" -> "+2 +2" (up 2 semitones, up 2 semitones)
-        """
-        indices = self.to_pitch_indices()
-        if len(indices) < 2:
-            return ""
         intervals = []
-        for i in range(1, len(indices)):
-            diff = indices[i] - indices[i-1]
-            intervals.append(f"{diff:+d}")
-        return " ".join(intervals)
+        total_interval = 0
+        prev_index = None
+        for note in self.notes:
+            index = note.pitch_midi % 12
+            pitches.append(pitch_classes[index])
+            rhythms.append(duration_to_kern(note.duration))
+            if prev_index is not None:
+                intervals.append(INTERVAL_TOKENS[index - prev_index + 11])
+                total_interval += abs(index - prev_index)
+            prev_index = index
+        
+        return ThemeSummary(
+            pitch_sequence=" ".join(pitches),
+            rhythm_sequence=" ".join(rhythms),
+            interval_profile=" ".join(intervals),
+            avg_interval=total_interval / len(intervals) if intervals else 0.0
+        )
 
 
 class MTDParser:
@@ -98,6 +106,35 @@ class MTDParser:
     
     def __init__(self, mtd_root: Path):
         self.mtd_root = Path(mtd_root)
+        # Per-directory {MTD ID: file path} indexes, built on first use so
+        # lookups don't glob the whole directory for every theme
+        self._file_indexes: Dict[str, Dict[str, Path]] = {}
+        self._index_lock = threading.Lock()
+    
+    def _find_file(self, subdir: str, suffix: str, mtd_id: str) -> Optional[Path]:
+        """Find the MTD<id>_*<suffix> file for an ID in a dataset subdirectory."""
+        with self._index_lock:
+            index = self._file_indexes.get(subdir)
+            if index is None:
+                index = self._file_indexes[subdir] = self._index_dir(self.mtd_root / subdir, suffix)
+        return index.get(mtd_id)
+    
+    @staticmethod
+    def _index_dir(directory: Path, suffix: str) -> Dict[str, Path]:
+        """Map MTD IDs to MTD<id>_*<suffix> files, keeping the first match per ID."""
+        index = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if not (name.startswith("MTD") and name.endswith(suffix)):
+                        continue
+                    separator = name.find('_', 3)
+                    if separator != -1:
+                        index.setdefault(name[3:separator], directory / name)
+        except FileNotFoundError:
+            pass
+        return index
     
     def parse_theme(self, mtd_id: str) -> Optional[MTDTheme]:
         """
@@ -114,44 +151,46 @@ class MTDParser:
             mtd_id = mtd_id[3:]
         
         # Find metadata file
-        meta_pattern = f"MTD{mtd_id}_*.json"
-        meta_files = list(self.mtd_root.glob(f"data_META/{meta_pattern}"))
+        meta_file = self._find_file("data_META", ".json", mtd_id)
         
-        if not meta_files:
+        if not meta_file:
             return None
         
-        meta_file = meta_files[0]
-        
         # Load metadata
         try:
-            with open(meta_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            metadata = load_json(meta_file)
         except Exception as e:
             print(f"⚠️  Error loading metadata {meta_file}: {e}")
             return None
         
         # Find corresponding CSV file
-        csv_pattern = f"MTD{mtd_id}_*.csv"
-        csv_files = list(self.mtd_root.glob(f"data_SCORE_CSV/{csv_pattern}"))
+        csv_file = self._find_file("data_SCORE_CSV", ".csv", mtd_id)
         
-        if not csv_files:
+        if not csv_file:
             return None
         
-        csv_file = csv_files[0]
-        
         # Parse CSV
         notes = []
         try:
-            with open(csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f, delimiter=';')
+            with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f, delimiter=';')
+                
+                # Resolve column positions once instead of building a dict per row
+                columns = {name: i for i, name in enumerate(next(reader, []))}
+                if not {'Pitch', 'Start', 'Duration'} <= columns.keys():
+                    return None
+                pitch_col = columns['Pitch']
+                start_col = columns['Start']
+                duration_col = columns['Duration']
+                
                 for row in reader:
                     try:
                         notes.append(MTDNote(
-                            pitch_midi=int(float(row['Pitch'])),
-                            start_time=float(row['Start']),
-                            duration=float(row['Duration'])
+                            pitch_midi=int(float(row[pitch_col])),
+                            start_time=float(row[start_col]),
+                            duration=float(row[duration_col])
                         ))
-                    except (ValueError, KeyError) as e:
+                    except (ValueError, IndexError):
                         continue  # Skip invalid rows
         except Exception as e:
             print(f"⚠️  Error parsing CSV {csv_file}: {e}")
@@ -224,8 +263,9 @@ if __name__ == "__main__":
                 print(f"Work: {theme.work_id} - {theme.work_title}")
                 print(f"Instruments: {theme.instruments}")
                 print(f"Notes count: {len(theme.notes)}")
-                print(f"\nPitch sequence: {theme.to_pitch_sequence()[:100]}...")
-                print(f"Interval profile: {theme.compute_interval_profile()[:50]}...")
+                summary = theme.summarize()
+                print(f"\nPitch sequence: {summary.pitch_sequence[:100]}...")
+                print(f"Interval profile: {summary.interval_profile[:50]}...")
             else:
                 print(f"⚠️  Theme not found: MTD{mtd_id}")
 
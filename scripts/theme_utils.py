@@ -0,0 +1,35 @@
+"""
+Shared helpers for the theme import scripts.
+Loads JSON data files, provides interval tokens for interval profiles and
+computes motif checksums.
+"""
+
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+# The scripts use dataclass(slots=True), added in Python 3.10
+if sys.version_info < (3, 10):
+    raise RuntimeError(f"Python 3.10+ is required (running {sys.version.split()[0]})")
+
+try:
+    import orjson  # Optional: faster JSON decoding
+except ImportError:
+    orjson = None
+
+# Signed interval tokens ("-11" ... "+11"), indexed by interval + 11
+INTERVAL_TOKENS = tuple(f"{diff:+d}" for diff in range(-11, 12))
+
+
+def load_json(path: Path):
+    """Read and decode a JSON file, using orjson when it is installed."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def checksum(text: str) -> str:
+    """Return the SHA256 hex digest used for motif duplicate detection."""
+    # Duplicate-detection fingerprint only, not a security boundary
+    return hashlib.sha256(text.encode(), usedforsecurity=False).hexdigest()